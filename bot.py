@@ -7,12 +7,19 @@ import platform
 import signal
 import re
 from pathlib import Path
-from gemini_kb import answer, get_store_audit
+from gemini_kb import answer, answer_cache_stats, answer_multi, get_store_audit, get_store_stats
+import semantic_cache
+import atexit
+import hashlib
 import json
+import queue
 import uuid
-from typing import Optional
+from collections import Counter, OrderedDict, defaultdict, deque
+from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple, Optional
 
-from gsheets_feedback import append_feedback_row
+from gsheets_feedback import append_feedback_rows
 
 # load .env if present
 try:
@@ -21,25 +28,80 @@ try:
 except Exception:
     pass
 
+# orjson opcional: parsea bytes directamente en C (3-5x más rápido que json
+# sobre un sync_state.json grande); con stdlib como fallback
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from google.genai import errors as genai_errors
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential,
+    before_sleep_log,
+)
+
+class Config(NamedTuple):
+    """Toda la configuración de entorno, leída una sola vez al importar.
+    El acceso por atributo (índice C de tupla) sustituye a os.getenv disperso."""
+    slack_bot_token: Optional[str]
+    slack_app_token: Optional[str]
+    log_level: str
+    post_cooldown_seconds: float
+    seen_ttl_seconds: int
+    buffer_seconds: float
+    bot_workers: int
+    answer_max_parallel: int
+    feedback_cooldown_seconds: float
+    feedback_sheet_id: Optional[str]
+    feedback_secrets_path: str
+    feedback_flush_interval: float
+
+    @classmethod
+    def load(cls) -> "Config":
+        env = os.environ
+        return cls(
+            slack_bot_token=env.get("SLACK_BOT_TOKEN"),
+            slack_app_token=env.get("SLACK_APP_TOKEN"),
+            log_level=env.get("LOG_LEVEL", "INFO").upper(),
+            post_cooldown_seconds=float(env.get("POST_COOLDOWN_SECONDS", "2.0")),
+            seen_ttl_seconds=int(env.get("SEEN_TTL_SECONDS", "60")),
+            buffer_seconds=float(env.get("BUFFER_SECONDS", "3.5")),
+            bot_workers=int(env.get("BOT_WORKERS", "8")),
+            answer_max_parallel=int(env.get("ANSWER_MAX_PARALLEL", "5")),
+            feedback_cooldown_seconds=float(env.get("FEEDBACK_COOLDOWN_SECONDS", "30")),
+            feedback_sheet_id=env.get("FEEDBACK_SHEET_ID"),
+            feedback_secrets_path=env.get("FEEDBACK_SECRETS_PATH", "./secrets"),
+            feedback_flush_interval=float(env.get("FEEDBACK_FLUSH_INTERVAL", "5")),
+        )
+
+
+CFG = Config.load()
 
 # Slack app initialization (reads tokens from env or .env)
-SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
-SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
+SLACK_BOT_TOKEN = CFG.slack_bot_token
+SLACK_APP_TOKEN = CFG.slack_app_token
 app = App(token=SLACK_BOT_TOKEN) if SLACK_BOT_TOKEN else App()
 
 # --- Logging setup: write to `logs/bot.log` with rotation (keeps logging minimal/INFO)
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-# Logging setup: rotating file + optional console; level configurable via LOG_LEVEL
+# Logging setup: rotating file + consola, drenados por un QueueListener en su
+# propio hilo. Los hilos de eventos de Slack sólo pagan un queue.put por
+# registro; el fstat/write/rename de la rotación ocurre fuera del hot path.
 LOG_DIR = Path(__file__).parent / "logs"
+_log_listener = None
 try:
     LOG_DIR.mkdir(parents=True, exist_ok=True)
     log_file = LOG_DIR / "bot.log"
 
     root_logger = logging.getLogger()
-    level_str = os.getenv("LOG_LEVEL", "INFO").upper()
+    level_str = CFG.log_level
     level = getattr(logging, level_str, logging.INFO)
     root_logger.setLevel(level)
 
@@ -48,19 +110,35 @@ try:
     # Rotating file handler
     rh = RotatingFileHandler(str(log_file), maxBytes=5_000_000, backupCount=3, encoding="utf-8")
     rh.setFormatter(fmt)
-    if not any(isinstance(h, RotatingFileHandler) for h in root_logger.handlers):
-        root_logger.addHandler(rh)
 
     # Stream handler to stdout for real-time console debugging
     sh = logging.StreamHandler(sys.stdout)
     sh.setFormatter(fmt)
-    if not any(isinstance(h, logging.StreamHandler) for h in root_logger.handlers):
-        root_logger.addHandler(sh)
+
+    _log_queue: "queue.Queue" = queue.Queue(-1)
+    _log_listener = QueueListener(_log_queue, rh, sh, respect_handler_level=True)
+    _log_listener.start()
+    if not any(isinstance(h, QueueHandler) for h in root_logger.handlers):
+        root_logger.addHandler(QueueHandler(_log_queue))
 
     logging.info("Logging configured: file=%s level=%s pid=%d cwd=%s py=%s", str(log_file), level_str, os.getpid(), os.getcwd(), platform.python_version())
 except Exception:
     logging.exception("Failed to configure logging")
 
+
+def _stop_log_listener():
+    """Para el listener una sola vez (llamable desde atexit y el finally)."""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None:
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+
+atexit.register(_stop_log_listener)
+
 # Ensure uncaught exceptions get logged
 def _excepthook(exc_type, exc_value, exc_tb):
     logging.critical("Uncaught exception", exc_info=(exc_type, exc_value, exc_tb))
@@ -81,48 +159,284 @@ signal.signal(signal.SIGINT, _signal_handler)
 signal.signal(signal.SIGTERM, _signal_handler)
 # Runtime globals for buffering / dedupe
 _lock = threading.Lock()
-_last_text: dict = {}
-_timers: dict = {}
-_last_post_ts: dict = {}
-_seen_event_ids: dict = {}
+_last_text: dict = {}  # channel -> lista de mensajes en la ventana de buffer
+_deadlines: dict = {}  # channel -> momento en que toca hacer flush
+_sched_cv = threading.Condition(_lock)
+
+# Locks por shard de canal: dos DMs de usuarios distintos no se serializan
+# entre sí en los paths de cooldown/contexto. El CV del scheduler sigue siendo
+# único porque el hilo de scheduling necesita una sola condición que esperar.
+_LOCK_SHARDS = 16
+_channel_locks = [threading.Lock() for _ in range(_LOCK_SHARDS)]
+_seen_lock = threading.Lock()  # _seen_event_ids se indexa por event_id, no por canal
+
+
+def _lock_for(channel: str) -> threading.Lock:
+    return _channel_locks[hash(channel) % _LOCK_SHARDS]
+
+
+class Lawn:
+    """Dict con TTL estilo "lawn": una deque FIFO por valor de TTL distinto.
+    Como las inserciones de un mismo TTL quedan ordenadas por tiempo, mow()
+    sólo paga O(entradas expiradas), nunca O(n) sobre todo el mapa.
+    """
+
+    def __init__(self, max_entries: int | None = None):
+        self._lock = threading.Lock()
+        self._values: dict = {}   # key -> (value, expiry)
+        self._buckets: dict = {}  # ttl -> deque[(expiry, key)]
+        self._max = max_entries
+
+    def set(self, key, value, ttl: float):
+        expiry = time.monotonic() + ttl
+        with self._lock:
+            self._values[key] = (value, expiry)
+            self._buckets.setdefault(ttl, deque()).append((expiry, key))
+            self._enforce_cap()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return default
+            value, expiry = item
+            if expiry <= time.monotonic():
+                self._values.pop(key, None)
+                return default
+            return value
+
+    def add_if_absent(self, key, value, ttl: float) -> bool:
+        """Inserta sólo si la clave no existe o ya expiró (check+set atómico,
+        útil para cooldowns). Devuelve True si insertó."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None and item[1] > now:
+                return False
+            expiry = now + ttl
+            self._values[key] = (value, expiry)
+            self._buckets.setdefault(ttl, deque()).append((expiry, key))
+            self._enforce_cap()
+            return True
+
+    def _enforce_cap(self):
+        """Tope duro de entradas además del TTL (llamar con self._lock tomado):
+        expulsa lo más antiguo aunque no haya expirado."""
+        while self._max is not None and len(self._values) > self._max:
+            bucket = min((b for b in self._buckets.values() if b),
+                         key=lambda b: b[0][0], default=None)
+            if bucket is None:
+                break
+            expiry, key = bucket.popleft()
+            item = self._values.get(key)
+            # no tocar valores refrescados con una expiry posterior
+            if item is not None and item[1] == expiry:
+                self._values.pop(key, None)
+
+    def mow(self):
+        """Evita crecimiento sin límite: barre sólo las entradas vencidas."""
+        now = time.monotonic()
+        with self._lock:
+            for bucket in self._buckets.values():
+                while bucket and bucket[0][0] <= now:
+                    _, key = bucket.popleft()
+                    item = self._values.get(key)
+                    # sólo evictar si no fue refrescada con una expiry posterior
+                    if item is not None and item[1] <= now:
+                        self._values.pop(key, None)
+
+
+# Cola de feedback: las filas se agrupan en memoria y un hilo las vuelca a
+# Sheets en lotes (1 RPC por lote en vez de 1 por click)
+_feedback_queue: "queue.Queue[dict]" = queue.Queue()
+
+
+def _feedback_flusher():
+    while True:
+        rows = [_feedback_queue.get()]  # bloquea hasta la primera fila
+        deadline = time.monotonic() + FEEDBACK_FLUSH_INTERVAL
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(_feedback_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            append_feedback_rows(rows, sheet_id=FEEDBACK_SHEET_ID)
+        except Exception:
+            logging.exception("Failed to flush %d feedback row(s) to sheet", len(rows))
+
+
+def _drain_feedback_queue():
+    """Vuelca lo que quede en la cola antes de apagar (atexit / shutdown)."""
+    rows = []
+    try:
+        while True:
+            rows.append(_feedback_queue.get_nowait())
+    except queue.Empty:
+        pass
+    if rows:
+        try:
+            append_feedback_rows(rows, sheet_id=FEEDBACK_SHEET_ID)
+        except Exception:
+            logging.exception("Failed to drain %d feedback row(s) at shutdown", len(rows))
+
+
+threading.Thread(target=_feedback_flusher, name="feedback-flusher", daemon=True).start()
+atexit.register(_drain_feedback_queue)
+
+# Mapas con TTL gestionados por Lawn (antes dicts que crecían sin límite —
+# _answer_context nunca se limpiaba)
+ANSWER_CTX_TTL = 3600.0
+FLUSHED_HASH_TTL = 300.0
+ERROR_POST_COOLDOWN_SECONDS = 30.0
+USER_INFO_TTL = 600.0
+_post_cooldowns = Lawn()      # channel -> ts del último post
+_feedback_cooldowns = Lawn()  # user_id -> ts del último feedback
+# prompt+respuesta pueden pesar KBs por entrada: tope duro además del TTL
+_answer_context = Lawn(max_entries=1024)  # message_ts -> contexto prompt/respuesta
+_last_flushed_hash = Lawn()   # channel -> blake2b del último texto flusheado
+_error_post_cooldowns = Lawn()  # channel -> ts del último aviso de error
+_user_info_cache = Lawn()     # user_id -> (username, email)
+_LAWNS = (_post_cooldowns, _feedback_cooldowns, _answer_context,
+          _last_flushed_hash, _error_post_cooldowns, _user_info_cache)
+
 
-# Tunables (env override)
-POST_COOLDOWN_SECONDS = float(os.getenv("POST_COOLDOWN_SECONDS", "2.0"))
-SEEN_TTL_SECONDS = int(os.getenv("SEEN_TTL_SECONDS", "60"))
-BUFFER_SECONDS = float(os.getenv("BUFFER_SECONDS", "3.5"))
+def _mow_lawns():
+    for lawn in _LAWNS:
+        lawn.mow()
+
+
+# Singleflight: si dos DMs piden exactamente lo mismo a la vez, el segundo
+# espera el Future del primero en vez de lanzar otra llamada al KB
+_inflight: dict = {}  # hash(texto normalizado) -> Future
+_inflight_lock = threading.Lock()
+
+
+def _answer_singleflight(text: str) -> str:
+    key = hashlib.blake2b(text.strip().lower().encode(), digest_size=16).hexdigest()
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        owner = fut is None
+        if owner:
+            fut = Future()
+            _inflight[key] = fut
+
+    if not owner:
+        return fut.result(timeout=120)
+
+    try:
+        final_text = _get_answer_response(text)
+    except BaseException as e:  # _get_answer_response no debería lanzar, por si acaso
+        fut.set_exception(e)
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        raise
+    fut.set_result(final_text)
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    return final_text
+# Dedupe de eventos: OrderedDict usado como LRU acotado (inserciones en orden
+# temporal, así la expiración saca del frente en O(1))
+_seen_event_ids: "OrderedDict[str, float]" = OrderedDict()
+MAX_SEEN_EVENTS = 10_000
+
+# Tunables (env override, via CFG)
+POST_COOLDOWN_SECONDS = CFG.post_cooldown_seconds
+SEEN_TTL_SECONDS = CFG.seen_ttl_seconds
+BUFFER_SECONDS = CFG.buffer_seconds
 
 # Feedback settings
-_last_feedback_time: dict = {}
-_answer_context: dict = {}  # stores prompt/response context by message_ts
-FEEDBACK_COOLDOWN_SECONDS = float(os.getenv("FEEDBACK_COOLDOWN_SECONDS", "30"))
-FEEDBACK_SHEET_ID = os.getenv("FEEDBACK_SHEET_ID")
-FEEDBACK_SECRETS_PATH = os.getenv("FEEDBACK_SECRETS_PATH", "./secrets")
-
-# Section inference index (built lazily)
-_SECTION_INDEX = None  # token -> set(sections)
+FEEDBACK_COOLDOWN_SECONDS = CFG.feedback_cooldown_seconds
+FEEDBACK_SHEET_ID = CFG.feedback_sheet_id
+FEEDBACK_SECRETS_PATH = CFG.feedback_secrets_path
+FEEDBACK_FLUSH_INTERVAL = CFG.feedback_flush_interval
+
+# Pool acotado para el trabajo pesado de _flush (Gemini + Slack API): el hilo
+# de scheduling sólo encola, no bloquea, y N canales pueden flushear a la vez
+_pool = ThreadPoolExecutor(max_workers=CFG.bot_workers, thread_name_prefix="flush")
+
+# Pool separado para I/O de feedback (users_info, Sheets, ephemerals): así no
+# compite con los flushes de respuestas ni bloquea el dispatcher de Bolt
+IO_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="slack-io")
+
+# Regexes calientes compiladas una sola vez a nivel de módulo
+_PREFIX_RE = re.compile(r"^([A-Za-z0-9_-]+):\s*(.+)$")
+_SOURCES_RE = re.compile(r"(?im)(fuentes|sources|references):\s")
+_WORD_RE = re.compile(r"\w+")
+
+# Sub-estructura constante del botón de feedback: _flush sólo rellena `value`
+# en vez de reconstruir ~12 dicts anidados por mensaje
+_FEEDBACK_BUTTON = {
+    "type": "button",
+    "text": {"type": "plain_text", "text": "Dar feedback"},
+    "action_id": "open_feedback_modal",
+}
+
+# Emoji por sección (constante, no reconstruir por mensaje)
+EMOJI_MAP = {
+    "incidents": "🚨",
+    "devrel": "👨‍💻",
+    "growth": "📈",
+    "handbook": "📖",
+    "organization": "🏢",
+    "shared": "🔗",
+}
+
+# Comandos single-shot que no necesitan la ventana de debounce. frozensets:
+# membership O(1) y sin reconstruir literales por mensaje
+_AUDIT_ALIASES = frozenset({"audit", "@audit", "!audit", "kb audit", "store audit"})
+_STATS_ALIASES = frozenset({"stats", "@stats", "!stats", "kb stats"})
+_SPECIAL_CMDS = _AUDIT_ALIASES | _STATS_ALIASES
+
+# Chit-chat que nunca debe disparar el scoring de secciones
+STOPWORDS = frozenset({
+    "hola", "hi", "hello", "hey", "buenas", "buenos", "dias", "días",
+    "gracias", "thanks", "thank", "you", "ok", "vale", "genial",
+    "adios", "adiós", "bye", "si", "sí", "no", "jaja", "jeje",
+})
+
+# Section inference index (built lazily, refreshed on mtime change)
+_SECTION_INDEX = None  # token -> frozenset(sections)
 _SECTIONS = None
+_INDEX_TOKENS = frozenset()  # todos los tokens indexados, para pre-filtrar
+_SECTION_ALT_RE = None  # alternación única con todos los nombres de sección
+_SECTION_INDEX_MTIME = None
 
 
 def build_section_index(sync_state_path: str | Path = None):
     """Construye un índice simple token -> sections a partir de `sync_state.json`.
     Utiliza los nombres de fichero y la ruta para generar tokens asociados a cada sección.
+    Se reconstruye sólo cuando cambia el mtime del fichero, así un bot de larga
+    vida recoge actualizaciones del KB sin reiniciar.
     """
-    global _SECTION_INDEX, _SECTIONS
-    if _SECTION_INDEX is not None and _SECTIONS is not None:
-        return
+    global _SECTION_INDEX, _SECTIONS, _INDEX_TOKENS, _SECTION_ALT_RE, _SECTION_INDEX_MTIME
 
     if sync_state_path is None:
-        sync_state_path = os.getenv("SYNC_STATE_PATH", "/Users/quero/Downloads/Scripts_VSCode/Handbook_MVP_File_Search/sync_state.json")
+        # mismo default portable que gemini_kb: el fichero junto al código
+        sync_state_path = os.getenv("SYNC_STATE_PATH", str(Path(__file__).resolve().parent / "sync_state.json"))
 
     try:
         p = Path(sync_state_path)
         if not p.exists():
             _SECTION_INDEX = {}
-            _SECTIONS = set()
+            _SECTIONS = frozenset()
+            _INDEX_TOKENS = frozenset()
+            _SECTION_ALT_RE = None
+            _SECTION_INDEX_MTIME = None
             return
 
-        raw = json.loads(p.read_text(encoding="utf-8"))
-        idx = {}
+        st = p.stat()
+        if _SECTION_INDEX is not None and _SECTION_INDEX_MTIME == st.st_mtime:
+            return
+
+        if _orjson is not None:
+            raw = _orjson.loads(p.read_bytes())
+        else:
+            raw = json.loads(p.read_bytes())
+        idx = defaultdict(set)  # sin el set() desechable que aloca setdefault
         secs = set()
         for fullpath in raw.keys():
             parts = fullpath.split("/")
@@ -132,18 +446,29 @@ def build_section_index(sync_state_path: str | Path = None):
             secs.add(section)
             name = parts[-1]
             # tokens from filename and section
-            tokens = re.findall(r"\w+", name.lower())
-            tokens += re.findall(r"\w+", section.lower())
+            tokens = _WORD_RE.findall(name.lower())
+            tokens += _WORD_RE.findall(section.lower())
             for t in tokens:
                 if not t:
                     continue
-                idx.setdefault(t, set()).add(section)
-
-        _SECTION_INDEX = idx
-        _SECTIONS = secs
+                idx[t].add(section)
+
+        # valores inmutables: sin churn de sets mutables y compartibles entre hilos
+        _SECTION_INDEX = {t: frozenset(v) for t, v in idx.items()}
+        _SECTIONS = frozenset(secs)
+        _INDEX_TOKENS = frozenset(_SECTION_INDEX)
+        # una pasada DFA en vez de len(_SECTIONS) búsquedas por mensaje
+        _SECTION_ALT_RE = (
+            re.compile(r"\b(" + "|".join(re.escape(s) for s in sorted(secs)) + r")\b", re.I)
+            if secs else None
+        )
+        _SECTION_INDEX_MTIME = st.st_mtime
     except Exception:
         _SECTION_INDEX = {}
-        _SECTIONS = set()
+        _SECTIONS = frozenset()
+        _INDEX_TOKENS = frozenset()
+        _SECTION_ALT_RE = None
+        _SECTION_INDEX_MTIME = None
 
 
 def infer_section_from_text(text: str) -> str | None:
@@ -151,30 +476,37 @@ def infer_section_from_text(text: str) -> str | None:
     Regresa el nombre de la sección o None si no hay suficiente evidencia.
     """
     try:
+        # Rechazo rápido: mensajes muy cortos, sólo-emoji o de cortesía no
+        # justifican pasar por el regex + scoring del índice
+        if not text or len(text) < 6 or text.strip().startswith(":"):
+            return None
+
         build_section_index()
         if not _SECTION_INDEX:
             return None
 
-        q = (text or "").lower()
-        words = re.findall(r"\w+", q)
-        scores = {}
-        # direct match of section name has high weight
-        for s in _SECTIONS:
-            if s and re.search(rf"\b{re.escape(s)}\b", q, flags=re.I):
-                scores[s] = scores.get(s, 0) + 5
+        q = text.lower()
+        words = _WORD_RE.findall(q)
+        if not words or STOPWORDS.issuperset(words):
+            return None
+        # Pre-filtro barato: si ningún token del mensaje está indexado ni se
+        # menciona una sección, no hay nada que puntuar (saludos, small talk)
+        if _INDEX_TOKENS.isdisjoint(words) and not any(s in q for s in _SECTIONS):
+            return None
 
-        for w in words:
-            secs = _SECTION_INDEX.get(w)
-            if not secs:
-                continue
-            for s in secs:
-                scores[s] = scores.get(s, 0) + 1
+        # puntuar todos los tokens en una pasada C-level (Counter + chain)
+        scores = Counter(chain.from_iterable(_SECTION_INDEX.get(w, ()) for w in words))
+
+        # direct match of section name has high weight
+        if _SECTION_ALT_RE is not None:
+            for s in _SECTION_ALT_RE.findall(q):
+                scores[s.lower()] += 5
 
         if not scores:
             return None
 
         # pick best
-        best, best_score = max(scores.items(), key=lambda kv: kv[1])
+        best, best_score = scores.most_common(1)[0]
         # threshold: need at least 2 points or direct match
         if best_score >= 2:
             return best
@@ -192,7 +524,28 @@ def _get_special_command_response(text: str) -> str | None:
         if not text:
             return None
 
-        if text.strip() in ("audit", "kb audit", "store audit"):
+        cmd = text.strip()
+        if cmd not in _SPECIAL_CMDS:
+            return None
+
+        if cmd in _STATS_ALIASES:
+            stats = get_store_stats()
+            # Sin isinstance: el resultado puede ser dict o MappingProxyType
+            if "total_documents" not in stats:
+                return f"❌ Error en stats: {stats.get('error', 'desconocido')}"
+
+            msg = "📊 *KB Store Stats*\n\n"
+            msg += f"📚 Documentos indexados: *{stats.get('total_documents', 0)}*\n"
+            if stats.get("fallback"):
+                msg += "⚠️ _datos del sync_state local (API inaccesible)_\n"
+            cache = answer_cache_stats()
+            msg += (
+                f"🧠 Cache de respuestas: {cache['hits']} hits / "
+                f"{cache['misses']} misses ({cache['entries']} entradas)"
+            )
+            return msg
+
+        if cmd in _AUDIT_ALIASES:
             audit = get_store_audit()
             if isinstance(audit, dict) and "error" in audit:
                 return f"❌ Error en audit: {audit['error']}"
@@ -219,146 +572,339 @@ def _get_special_command_response(text: str) -> str | None:
 
 
 def parse_multi_sections(text: str):
-    """Parsea consultas con prefijo de sección opcional.
+    """Parsea consultas con prefijos de sección opcionales (uno por línea).
     Devuelve lista de tuplas: (metadata_filter, clean_text, label)
     Ejemplos:
-      "incidents: cómo..." -> ({'section': 'incidents'}, 'cómo...', 'incidents')
-      "pregunta normal" -> (None, 'pregunta normal', None)
+      "incidents: cómo..." -> [('section="incidents"', 'cómo...', 'incidents')]
+      "growth: X\\ndevrel: Y" -> una tupla por sección
+      "pregunta normal" -> [(None, 'pregunta normal', None)]
     """
     if not text:
         return [(None, "", None)]
 
-    m = re.match(r"^([A-Za-z0-9_-]+):\s*(.+)$", text.strip())
-    if m:
-        label = m.group(1).lower()
-        rest = m.group(2).strip()
-        # Return metadata_filter as a string expression accepted by File Search
-        mf = f'section="{label}"'
-        return [(mf, rest, label)]
+    # Caso común (pregunta única sin prefijo): ni regex ni bucle por líneas
+    if ":" not in text:
+        return [(None, text.strip(), None)]
+
+    parts = []  # (mf, [líneas], label)
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        m = _PREFIX_RE.match(line)
+        if m:
+            label = m.group(1).lower()
+            rest = m.group(2).strip()
+            # metadata_filter como expresión string aceptada por File Search
+            mf = f'section="{label}"'
+            parts.append((mf, [rest], label))
+        elif parts:
+            # línea de continuación de la consulta anterior
+            parts[-1][1].append(line)
+        else:
+            parts.append((None, [line], None))
+
+    if not parts:
+        return [(None, text.strip(), None)]
+
+    return [(mf, "\n".join(lines), label) for mf, lines, label in parts]
+
+
+# Pool acotado para resolver varias secciones en paralelo sin pasarnos de rate limit
+_ANSWER_POOL = ThreadPoolExecutor(
+    max_workers=CFG.answer_max_parallel, thread_name_prefix="answer"
+)
+
+# --- Retries con backoff exponencial: un 429/5xx transitorio no debe acabar
+# --- como "⚠️ Error" permanente para el usuario
+_EXP_WAIT = wait_exponential(multiplier=0.5, min=0.5, max=8)
+_RETRY_LOG = before_sleep_log(logging.getLogger("bot.retry"), logging.WARNING)
+
+
+def _is_transient_slack_error(exc) -> bool:
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def _is_transient_genai_error(exc) -> bool:
+    """Sólo red caída o 429/5xx de Gemini; un 4xx (p.ej. metadata_filter
+    inválido) fallaría igual en los 4 intentos y retrasaría el error."""
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(exc, genai_errors.APIError):
+        code = getattr(exc, "code", None)
+        return code == 429 or (code is not None and code >= 500)
+    return False
+
+
+def _slack_retry_wait(retry_state):
+    """Respeta el header Retry-After de Slack si viene; si no, backoff exponencial."""
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            pass
+    return _EXP_WAIT(retry_state)
+
+
+@retry(
+    wait=_EXP_WAIT,
+    stop=stop_after_attempt(4),
+    retry=retry_if_exception(_is_transient_genai_error),
+    before_sleep=_RETRY_LOG,
+    reraise=True,
+)
+def _answer_retry(question: str, metadata_filter=None):
+    return answer(question, metadata_filter=metadata_filter)
+
+
+@retry(
+    wait=_slack_retry_wait,
+    stop=stop_after_attempt(4),
+    retry=retry_if_exception(_is_transient_slack_error),
+    before_sleep=_RETRY_LOG,
+    reraise=True,
+)
+def _post_retry(**kwargs):
+    # sin unfurls: Slack no debe hacer fetch de previews por cada path citado
+    kwargs.setdefault("unfurl_links", False)
+    kwargs.setdefault("unfurl_media", False)
+    return app.client.chat_postMessage(**kwargs)
+
+
+def _answer_part(metadata_filter, clean_text: str, label) -> str:
+    """Resuelve una (sección, pregunta) y devuelve su bloque formateado."""
+    try:
+        # If no explicit section/label provided, try to infer from the text
+        if not metadata_filter:
+            inferred = infer_section_from_text(clean_text)
+            if inferred:
+                metadata_filter = f'section="{inferred}"'
+                label = inferred
+
+        # If metadata_filter is a dict (old format), convert to string
+        if isinstance(metadata_filter, dict):
+            exprs = [f'{k}="{v}"' for k, v in metadata_filter.items()]
+            metadata_filter = " AND ".join(exprs)
+
+        text_out, sources = _answer_retry(clean_text, metadata_filter=metadata_filter)
+    except Exception as e:
+        text_out = f"⚠️ Error consultando el KB: {type(e).__name__}: {e}"
+        sources = []
+
+    return _format_block(label, text_out, sources)
 
-    return [(None, text.strip(), None)]
+
+def _format_block(label, text_out: str, sources) -> str:
+    """Formatea una respuesta (emoji de sección + fuentes) como bloque mrkdwn."""
+    if not text_out:
+        text_out = "❓ No he encontrado info suficiente en el KB. ¿Puedes dar más contexto?"
+
+    # Formatear la sección con emoji
+    if label:
+        emoji = EMOJI_MAP.get(label.lower(), "📚")
+        block = f"{emoji} *{label.upper()}*\n{text_out}"
+    else:
+        block = text_out
+
+    # Agregar fuentes con formato mejorado (si no existen ya en el bloque)
+    if sources and not _SOURCES_RE.search(block):
+        sources_formatted = "\n".join([f"📄 {s}" for s in sources])
+        block += f"\n\n_Fuentes:_\n{sources_formatted}"
+
+    return block
 
 
 def _get_answer_response(text: str) -> str:
     """Procesa la pregunta normal y retorna el texto formateado"""
     try:
         parts = parse_multi_sections(text)
-        blocks = []
 
-        for metadata_filter, clean_text, label in parts:
-            try:
-                # If no explicit section/label provided, try to infer from the text
-                if not metadata_filter:
-                    inferred = infer_section_from_text(clean_text)
-                    if inferred:
-                        metadata_filter = f'section="{inferred}"'
-                        label = inferred
-
-                # If metadata_filter is a dict (old format), convert to string
-                if isinstance(metadata_filter, dict):
-                    parts = [f'{k}="{v}"' for k, v in metadata_filter.items()]
-                    metadata_filter = " AND ".join(parts)
-
-                text_out, sources = answer(clean_text, metadata_filter=metadata_filter)
-            except Exception as e:
-                text_out = f"⚠️ Error consultando el KB: {type(e).__name__}: {e}"
-                sources = []
-
-            if not text_out:
-                text_out = "❓ No he encontrado info suficiente en el KB. ¿Puedes dar más contexto?"
-
-            # Formatear la sección con emoji
-            if label:
-                emoji_map = {
-                    "incidents": "🚨",
-                    "devrel": "👨‍💻",
-                    "growth": "📈",
-                    "handbook": "📖",
-                    "organization": "🏢",
-                    "shared": "🔗"
-                }
-                emoji = emoji_map.get(label.lower(), "📚")
-                block = f"{emoji} *{label.upper()}*\n{text_out}"
+        if len(parts) == 1:
+            blocks = [_answer_part(*parts[0])]
+        else:
+            # Partes repetidas (misma sección + mismo texto, p.ej. por copy-paste)
+            # se resuelven una sola vez; dict preserva el orden de aparición
+            unique = {}
+            for p in parts:
+                unique.setdefault((p[0], p[1]), p)
+            uparts = list(unique.values())
+
+            # Primero en lote: una sola llamada con salida JSON responde todas
+            # las secciones (1 RTT y un solo prefill del system prompt)
+            results = answer_multi(uparts)
+            if results is not None:
+                blocks = [_format_block(p[2], t, s) for p, (t, s) in zip(uparts, results)]
             else:
-                block = text_out
-
-            # Agregar fuentes con formato mejorado (si no existen ya en el bloque)
-            if sources and not re.search(r"(?im)(fuentes|sources|references):\s", block):
-                sources_formatted = "\n".join([f"📄 {s}" for s in sources])
-                block += f"\n\n_Fuentes:_\n{sources_formatted}"
-
-            blocks.append(block)
+                # Fallback: cada sección es un round-trip independiente que
+                # despachamos en paralelo (~max(una llamada) de latencia)
+                futures = [_ANSWER_POOL.submit(_answer_part, *p) for p in uparts]
+                # timeout defensivo: una sección colgada no debe bloquear el
+                # flush para siempre (el except de abajo responde con el error)
+                blocks = [f.result(timeout=30) for f in futures]
 
         # Return blocks joined with a blank line; remove visual separator line
         return "\n\n".join(blocks)
 
     except Exception as e:
         return f"⚠️ Error: {type(e).__name__}: {e}"
-    
+
+
+
+def _flush_special(channel: str, cmd: str):
+    """Responde un comando especial directamente, sin buffer ni debounce."""
+    response = _get_special_command_response(cmd)
+    if not response:
+        return
+    try:
+        _post_retry(channel=channel, text=response)
+    except Exception:
+        logging.exception("Failed to post special command response")
+
+
+def _scheduler_loop():
+    """Hilo único que reemplaza un `threading.Timer` por mensaje: espera la
+    deadline más próxima y hace flush de los canales vencidos. Re-postear un
+    mensaje sólo mueve la deadline del canal (coste O(1), sin crear hilos)."""
+    while True:
+        with _sched_cv:
+            while not _deadlines:
+                _sched_cv.wait()
+            now = time.monotonic()
+            next_deadline = min(_deadlines.values())
+            if next_deadline > now:
+                _sched_cv.wait(next_deadline - now)
+                continue
+            due = [ch for ch, dl in _deadlines.items() if dl <= now]
+            for ch in due:
+                _deadlines.pop(ch, None)
+        for ch in due:
+            _pool.submit(_flush, ch)
 
 
 def _flush(channel: str):
     """Procesa el texto acumulado y envía la respuesta"""
+    # Peek sin lock: si otro flush ya drenó el canal no tocamos el mutex
+    # (la lectura de dict es atómica bajo el GIL; el pop de abajo re-verifica)
+    if channel not in _last_text:
+        return
+
     with _lock:
-        text = _last_text.pop(channel, "").strip()
-        _t = _timers.pop(channel, None)
+        # on_message ya guarda el texto stripped; el join no reintroduce espacios
+        text = "\n".join(_last_text.pop(channel, []))
+        _deadlines.pop(channel, None)
 
     if not text:
         return
 
-    # Intentar comando especial primero
-    special_response = _get_special_command_response(text.lower())
-    if special_response:
-        final_text = special_response
-    else:
-        # Respuesta normal con IA
-        final_text = _get_answer_response(text)
+    # Retransmisiones o message_changed que esquivaron is_duplicate_event
+    # producirían exactamente el mismo texto acumulado: ni Gemini ni re-post.
+    # El shard lock hace atómico el check+set por canal sin serializar canales.
+    h = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    with _lock_for(channel):
+        if _last_flushed_hash.get(channel) == h:
+            return
+        _last_flushed_hash.set(channel, h, ttl=FLUSHED_HASH_TTL)
 
-    # Anti doble-post cooldown
-    now = time.time()
-    last = _last_post_ts.get(channel, 0)
-    if now - last < POST_COOLDOWN_SECONDS:
+    # Aprovechamos el flush para segar entradas TTL vencidas (O(expiradas))
+    _mow_lawns()
+
+    # Anti doble-post cooldown (antes de gastar trabajo en una respuesta
+    # que igualmente descartaríamos)
+    if not _post_cooldowns.add_if_absent(channel, time.monotonic(), POST_COOLDOWN_SECONDS):
+        return
+
+    # Placeholder inmediato: el usuario ve actividad en ~1 RTT de Slack en vez
+    # de esperar en silencio la latencia completa del modelo; luego se edita
+    # el mismo mensaje con chat_update
+    placeholder_ts = None
+    try:
+        resp = app.client.chat_postMessage(
+            channel=channel, text="⏳ pensando…",
+            unfurl_links=False, unfurl_media=False,
+        )
+        placeholder_ts = resp.get("ts")
+    except Exception:
+        logging.exception("Failed to post placeholder; will post answer directly")
+
+    # Intentar comando especial primero
+    try:
+        special_response = _get_special_command_response(text.lower())
+        if special_response:
+            final_text = special_response
+        else:
+            # Cache semántica: si una pregunta parecida ya fue respondida, evitamos
+            # el round-trip completo al modelo (los comandos especiales no pasan por aquí)
+            final_text = semantic_cache.lookup(text)
+            if final_text is None:
+                # Respuesta normal con IA (coalescida con llamadas idénticas en vuelo)
+                final_text = _answer_singleflight(text)
+                if not final_text.startswith(("⚠️", "❓")):
+                    semantic_cache.store(text, None, final_text)
+    except Exception as e:
+        # P.ej. un waiter del singleflight que agota su timeout: el scheduler
+        # descarta el Future de _pool.submit, así que si no lo capturamos aquí
+        # no queda ni log y el usuario se queda mirando "⏳ pensando…"
+        logging.exception("Answer generation failed for channel %s", channel)
+        err_text = f"⚠️ Error interno generando la respuesta: {type(e).__name__}. Intenta de nuevo en unos minutos."
+        try:
+            if placeholder_ts:
+                app.client.chat_update(channel=channel, ts=placeholder_ts, text=err_text)
+            else:
+                app.client.chat_postMessage(
+                    channel=channel, text=err_text,
+                    unfurl_links=False, unfurl_media=False,
+                )
+        except Exception:
+            logging.exception("Failed to deliver error notice for channel %s", channel)
         return
-    _last_post_ts[channel] = now
 
-    # Post as Block with an action button for feedback
+    # Post as Block with an action button for feedback. El value del botón es
+    # el answer_id pelado: no hace falta serializar un dict por mensaje.
     answer_id = uuid.uuid4().hex
     blocks = [
-        {"type": "section", "text": {"type": "mrkdwn", "text": final_text}}
+        {"type": "section", "text": {"type": "mrkdwn", "text": final_text}},
+        {"type": "actions", "elements": [{**_FEEDBACK_BUTTON, "value": answer_id}]},
     ]
-    try:
-        button_value = json.dumps({"answer_id": answer_id})
-    except Exception:
-        button_value = answer_id
-
-    blocks.append({
-        "type": "actions",
-        "elements": [
-            {
-                "type": "button",
-                "text": {"type": "plain_text", "text": "Dar feedback"},
-                "action_id": "open_feedback_modal",
-                "value": button_value
-            }
-        ]
-    })
 
     try:
-        res = app.client.chat_postMessage(channel=channel, blocks=blocks, text=(final_text[:3000] or "response"))
-        message_ts = res.get("ts")
-        # Store context for later retrieval in feedback modal
+        if placeholder_ts:
+            app.client.chat_update(
+                channel=channel, ts=placeholder_ts, blocks=blocks,
+                text=(final_text[:3000] or "response"),
+            )
+            message_ts = placeholder_ts
+        else:
+            res = _post_retry(channel=channel, blocks=blocks, text=(final_text[:3000] or "response"))
+            message_ts = res.get("ts")
+        # Store context for later retrieval in feedback modal (TTL-bounded)
         if message_ts:
-            _answer_context[message_ts] = {
+            _answer_context.set(message_ts, {
                 "prompt": text,
                 "response": final_text,
                 "answer_id": answer_id
-            }
+            }, ttl=ANSWER_CTX_TTL)
     except Exception as e:
         logging.exception("Failed to post message with blocks; falling back to text: %s", e)
-        app.client.chat_postMessage(channel=channel, text=final_text)
+        app.client.chat_postMessage(
+            channel=channel, text=final_text,
+            unfurl_links=False, unfurl_media=False,
+        )
         return
 
 
+# Un único hilo de scheduling para todos los canales
+_scheduler_thread = threading.Thread(target=_scheduler_loop, name="debounce-scheduler", daemon=True)
+_scheduler_thread.start()
+
+# Pre-construir el índice de secciones en background: el primer mensaje de un
+# usuario no paga el read+parse de sync_state.json dentro de su _flush
+threading.Thread(target=build_section_index, name="section-index-warmup", daemon=True).start()
+
+
 def is_duplicate_event(event) -> bool:
     """Detecta si ya hemos visto este evento (evita duplicados). Retorna True si está visto."""
     global _seen_event_ids
@@ -368,17 +914,21 @@ def is_duplicate_event(event) -> bool:
     if not event_id:
         return False
 
-    now = time.time()
+    now = time.monotonic()
 
-    # limpieza de IDs antiguos
-    expired = [k for k, t0 in _seen_event_ids.items() if now - t0 > SEEN_TTL_SECONDS]
-    for k in expired:
-        _seen_event_ids.pop(k, None)
+    with _seen_lock:
+        # limpieza de IDs antiguos: las entradas están en orden de inserción,
+        # basta con sacar del frente hasta que la cabeza esté fresca — O(1) amortizado
+        while _seen_event_ids and now - next(iter(_seen_event_ids.values())) > SEEN_TTL_SECONDS:
+            _seen_event_ids.popitem(last=False)
 
-    if event_id in _seen_event_ids:
-        return True
+        if event_id in _seen_event_ids:
+            return True
 
-    _seen_event_ids[event_id] = now
+        _seen_event_ids[event_id] = now
+        # tope duro de memoria ante ráfagas
+        while len(_seen_event_ids) > MAX_SEEN_EVENTS:
+            _seen_event_ids.popitem(last=False)
     return False
 
 
@@ -395,14 +945,16 @@ def handle_open_feedback_modal(ack, body, client, logger):
         channel_id = body.get("channel", {}).get("id") or message.get("channel")
         message_ts = message.get("ts")
 
-        # value may contain answer_id
-        value = {}
-        try:
-            value = json.loads(body.get("actions", [])[0].get("value") or "{}")
-        except Exception:
-            value = {}
-
-        answer_id = value.get("answer_id") or str(uuid.uuid4().hex)
+        # value es el answer_id en claro; mensajes antiguos (pre-cambio) aún
+        # pueden traer el JSON {"answer_id": ...}
+        actions = body.get("actions") or [{}]
+        raw_value = actions[0].get("value") or ""
+        if raw_value.startswith("{"):
+            try:
+                raw_value = json.loads(raw_value).get("answer_id") or ""
+            except Exception:
+                raw_value = ""
+        answer_id = raw_value or uuid.uuid4().hex
 
         # Get stored context (prompt/response)
         ctx = _answer_context.get(message_ts, {})
@@ -445,40 +997,47 @@ def handle_open_feedback_modal(ack, body, client, logger):
 @app.event("message")
 def on_message(event, logger):
     """Listener para mensajes directos al bot (con manejo de errores para evitar crash)."""
-    try:
-        # Ignora bots / subtypes
-        if event.get("bot_id") or event.get("subtype"):
-            return
-        if is_duplicate_event(event):
-            # opcional: logger.debug("Duplicate event ignored: %s", event)
-            return
-
-        # SOLO DM
-        if event.get("channel_type") != "im":
-            return
+    # Filtros baratos fuera de todo try: estas comprobaciones no pueden fallar
+    # y son el camino caliente de cada evento
+    if event.get("bot_id") or event.get("subtype"):
+        return
+    if is_duplicate_event(event):
+        # opcional: logger.debug("Duplicate event ignored: %s", event)
+        return
 
-        channel = event.get("channel")
-        text = (event.get("text") or "").strip()
-        if not channel or not text:
-            return
+    # SOLO DM
+    if event.get("channel_type") != "im":
+        return
 
-        with _lock:
-            _last_text[channel] = text
-            if channel in _timers:
-                _timers[channel].cancel()
+    channel = event.get("channel")
+    text = (event.get("text") or "").strip()
+    if not channel or not text:
+        return
 
-            t = threading.Timer(BUFFER_SECONDS, _flush, args=(channel,))
-            t.daemon = True
-            _timers[channel] = t
-            t.start()
+    # Comandos especiales al grano: `audit` no gana nada esperando la ventana
+    # de buffer, así que se despacha ya y el usuario se ahorra BUFFER_SECONDS
+    low = text.lower()
+    if low in _SPECIAL_CMDS:
+        _pool.submit(_flush_special, channel, low)
+        return
 
+    try:
+        with _sched_cv:
+            # acumular (no sobreescribir): "growth: X" y luego "devrel: Y" dentro
+            # de la ventana acaban en una sola llamada multi-sección
+            _last_text.setdefault(channel, []).append(text)
+            _deadlines[channel] = time.monotonic() + BUFFER_SECONDS
+            _sched_cv.notify()
     except Exception as e:
-        # Log the exception and attempt to notify the user in-channel
+        logger.exception("on_message failed: %s", e)
+        # Aviso en canal como mucho 1 vez cada 30s: un mensaje envenenado con
+        # reintentos de Slack no debe convertirse en una ráfaga de posts
+        if not _error_post_cooldowns.add_if_absent(
+            channel, time.monotonic(), ERROR_POST_COOLDOWN_SECONDS
+        ):
+            return
         try:
-            print(f"[ERROR] on_message failed: {type(e).__name__}: {e}")
-            ch = event.get("channel") if isinstance(event, dict) else None
-            if ch:
-                app.client.chat_postMessage(channel=ch, text=f"⚠️ Error interno: {type(e).__name__}: {e}")
+            app.client.chat_postMessage(channel=channel, text=f"⚠️ Error interno: {type(e).__name__}: {e}")
         except Exception:
             # nothing much we can do here
             pass
@@ -487,10 +1046,14 @@ def on_message(event, logger):
 @app.view("feedback_view")
 def handle_feedback_submission(ack, body, client, logger):
     """Handles submission of the feedback modal and writes to Google Sheets."""
-    try:
-        # Acknowledge the view_submission to Slack immediately
-        ack()
+    # Acknowledge the view_submission to Slack immediately; the Slack/Sheets
+    # round-trips happen on the I/O pool so the dispatcher thread is freed
+    ack()
+    IO_POOL.submit(_process_feedback_submission, body, client, logger)
+
 
+def _process_feedback_submission(body, client, logger):
+    try:
         user_id = body.get("user", {}).get("id")
         view = body.get("view", {})
         state = view.get("state", {}).get("values", {})
@@ -513,17 +1076,23 @@ def handle_feedback_submission(ack, body, client, logger):
             txt = cb.get("comment_action") or {}
             comment = txt.get("value")
 
-        # Get user info (name and email)
-        username = ""
-        email = ""
-        try:
-            user_info = client.users_info(user=user_id)
-            if user_info.get("ok"):
-                user_obj = user_info.get("user", {})
-                username = user_obj.get("real_name") or user_obj.get("name") or ""
-                email = user_obj.get("profile", {}).get("email") or ""
-        except Exception as e:
-            logger.warning("Failed to get user info for %s: %s", user_id, e)
+        # Get user info (name and email) — el perfil apenas cambia en sesión:
+        # cache de 10 min que ahorra un RTT a Slack por feedback repetido
+        cached = _user_info_cache.get(user_id)
+        if cached is not None:
+            username, email = cached
+        else:
+            username = ""
+            email = ""
+            try:
+                user_info = client.users_info(user=user_id)
+                if user_info.get("ok"):
+                    user_obj = user_info.get("user", {})
+                    username = user_obj.get("real_name") or user_obj.get("name") or ""
+                    email = user_obj.get("profile", {}).get("email") or ""
+                _user_info_cache.set(user_id, (username, email), ttl=USER_INFO_TTL)
+            except Exception as e:
+                logger.warning("Failed to get user info for %s: %s", user_id, e)
 
         # Get stored context
         message_ts = private_metadata.get("message_ts")
@@ -545,26 +1114,29 @@ def handle_feedback_submission(ack, body, client, logger):
         # Store channel for ephemeral messages
         channel_id = private_metadata.get("channel")
 
-        # cooldown per user
-        now = time.time()
-        last = _last_feedback_time.get(user_id, 0)
+        # cooldown per user (monotonic: inmune a saltos del reloj de pared;
+        # el timestamp de la fila sí es wall-clock porque va a la Sheet)
+        now = time.monotonic()
+        last = _feedback_cooldowns.get(user_id, 0)
         if now - last < FEEDBACK_COOLDOWN_SECONDS:
             client.chat_postEphemeral(channel=channel_id or user_id, user=user_id, text=f"⏳ Por favor espera {int(FEEDBACK_COOLDOWN_SECONDS - (now-last))}s antes de enviar otro feedback.")
             return
 
-        try:
-            append_feedback_row(row, sheet_id=FEEDBACK_SHEET_ID)
-            _last_feedback_time[user_id] = now
-            client.chat_postEphemeral(channel=channel_id or user_id, user=user_id, text="✅ Gracias — tu feedback se ha registrado.")
-        except Exception as e:
-            logger.exception("Failed to append feedback row: %s", e)
-            client.chat_postEphemeral(channel=channel_id or user_id, user=user_id, text="⚠️ No se ha podido guardar el feedback. Inténtalo más tarde.")
+        # Encolar para el flusher en lotes; la escritura a Sheets ya no está en
+        # el camino del submit (los fallos los loguea el flusher)
+        _feedback_queue.put(row)
+        _feedback_cooldowns.set(user_id, now, ttl=FEEDBACK_COOLDOWN_SECONDS)
+        client.chat_postEphemeral(channel=channel_id or user_id, user=user_id, text="✅ Gracias — tu feedback se ha registrado.")
 
     except Exception as e:
         logger.exception("Error handling feedback submission: %s", e)
 
 
 if __name__ == "__main__":
+    missing = [k for k, v in (("SLACK_BOT_TOKEN", SLACK_BOT_TOKEN), ("SLACK_APP_TOKEN", SLACK_APP_TOKEN)) if not v]
+    if missing:
+        raise RuntimeError(f"Falta configuración en .env: {', '.join(missing)}")
+
     logging.info("✅ Bot corriendo (Socket Mode)...")
     print("🤖 Bot encendido ✅")
 
@@ -593,5 +1165,7 @@ if __name__ == "__main__":
                 handler.stop()
         except Exception:
             pass
+        _drain_feedback_queue()
         logging.info("Bot shutdown complete")
+        _stop_log_listener()
         print("🛑 Bot detenido.")
\ No newline at end of file
@@ -1,14 +1,45 @@
 import os
+import hashlib
 import json
+import re
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import MappingProxyType
 from typing import List, Tuple
 from pathlib import Path
 
 from google import genai
 from google.genai import types
 import time
-import requests
+import random
 import threading
 
+# orjson opcional (mismo patrón que bot.py): parseo en C ~3-5x más rápido
+# sobre un sync_state.json grande; stdlib json como fallback
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+# .env antes que nada: las constantes de abajo se leen UNA vez en el import,
+# y bot.py nos importa antes de su propio load_dotenv()
+try:
+    from dotenv import load_dotenv
+    load_dotenv(Path(__file__).with_name(".env"))
+except Exception:
+    pass
+
+# Config leída una vez al importar: evita el lookup en os.environ y, sobre
+# todo, el split/strip de FILE_SEARCH_STORE_NAMES en cada pregunta
+_API_KEY = os.getenv("GEMINI_API_KEY")
+_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+_STORES = tuple(s.strip() for s in os.getenv("FILE_SEARCH_STORE_NAMES", "").split(",") if s.strip())
+_ALLOW_LOCAL_FALLBACK = os.getenv("ALLOW_LOCAL_SYNC_STATE_FALLBACK", "0") == "1"
+try:
+    _STATS_TTL = int(os.getenv("STORE_STATS_CACHE_TTL", "30"))
+except ValueError:
+    _STATS_TTL = 30
+
 
 SYSTEM_INSTRUCTION = """
 Eres el asistente interno del KB (Handbook). Tu trabajo es responder preguntas usando
@@ -67,145 +98,341 @@ Razonamiento: prioriza evidencia, estructura salidas, obliga a citar fuentes y g
 """.strip()
 
 
+# Cliente singleton: reutiliza la conexión TLS/HTTP entre llamadas en vez de
+# pagar handshake + init de transporte en cada mensaje de Slack
+_client_singleton = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    global _client_singleton
+    if _client_singleton is None:
+        with _client_lock:
+            if _client_singleton is None:
+                if not _API_KEY:
+                    raise RuntimeError("Falta GEMINI_API_KEY en .env")
+                _client_singleton = genai.Client(api_key=_API_KEY)
+    return _client_singleton
+
+
+# Context caching de Gemini: el SYSTEM_INSTRUCTION (+ tool de File Search sin
+# filtro) se sube una sola vez como CachedContent y cada llamada lo referencia
+# por nombre, así el prefill por request es sólo la pregunta del usuario.
+# Sólo aplica a consultas sin metadata_filter: el filtro vive dentro del tool
+# y cachearlo congelaría la sección.
+_context_cache_name = None
+_context_cache_lock = threading.Lock()
+# Negative cache del create: si la API lo rechaza (modelo sin soporte,
+# cuota…) no se reintenta hasta pasado este cooldown — sin él, cada answer()
+# sin filtro pagaría otro RPC fallido serializado bajo el lock global
+_context_cache_retry_ts = 0.0
+CONTEXT_CACHE_RETRY_SECONDS = float(os.getenv("GEMINI_CONTEXT_CACHE_RETRY_SECONDS", "300"))
+GEMINI_CONTEXT_CACHE_TTL = os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600s")
+
+
+def _get_context_cache(client, model: str, tool) -> str | None:
+    """Devuelve el nombre del CachedContent, creándolo perezosamente.
+    Si la creación falla (modelo sin soporte, cuota…) devuelve None, apunta
+    el fallo y las llamadas siguen con la config inline hasta el próximo
+    intento tras el cooldown.
+    """
+    global _context_cache_name, _context_cache_retry_ts
+    with _context_cache_lock:
+        if _context_cache_name is None:
+            now = time.monotonic()
+            if now < _context_cache_retry_ts:
+                return None
+            try:
+                cache = client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=SYSTEM_INSTRUCTION,
+                        tools=[tool],
+                        ttl=GEMINI_CONTEXT_CACHE_TTL,
+                    ),
+                )
+                _context_cache_name = cache.name
+            except Exception:
+                _context_cache_retry_ts = now + CONTEXT_CACHE_RETRY_SECONDS
+                return None
+        return _context_cache_name
+
+
+def _invalidate_context_cache():
+    global _context_cache_name
+    with _context_cache_lock:
+        _context_cache_name = None
+
+
+# Cache LRU+TTL de respuestas: el mismo (pregunta normalizada, filtro, modelo)
+# repetido dentro del TTL no vuelve a pagar el round-trip a Gemini
+_ANSWER_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> ((text, sources), ts)
+_ANSWER_CACHE_LOCK = threading.RLock()
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "600"))
+ANSWER_CACHE_MAX = 512
+_ANSWER_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _answer_cache_key(question: str, metadata_filter, model: str) -> tuple:
+    digest = hashlib.blake2b(question.strip().lower().encode(), digest_size=16).digest()
+    return (digest, metadata_filter, model)
+
+
+def _answer_cache_get(key):
+    now = time.time()
+    with _ANSWER_CACHE_LOCK:
+        item = _ANSWER_CACHE.get(key)
+        if item is None:
+            _ANSWER_CACHE_STATS["misses"] += 1
+            return None
+        value, ts = item
+        if now - ts > ANSWER_CACHE_TTL:
+            _ANSWER_CACHE.pop(key, None)
+            _ANSWER_CACHE_STATS["misses"] += 1
+            return None
+        _ANSWER_CACHE.move_to_end(key)
+        _ANSWER_CACHE_STATS["hits"] += 1
+        return value
+
+
+def _answer_cache_put(key, value):
+    with _ANSWER_CACHE_LOCK:
+        _ANSWER_CACHE[key] = (value, time.time())
+        _ANSWER_CACHE.move_to_end(key)
+        while len(_ANSWER_CACHE) > ANSWER_CACHE_MAX:
+            _ANSWER_CACHE.popitem(last=False)
+            _ANSWER_CACHE_STATS["evictions"] += 1
+
+
+def answer_cache_stats() -> dict:
+    """Contadores del cache de respuestas (para diagnósticos / comando stats)."""
+    with _ANSWER_CACHE_LOCK:
+        return {**_ANSWER_CACHE_STATS, "entries": len(_ANSWER_CACHE)}
+
+
+# Default portable: el sync_state se busca junto al código salvo que
+# SYNC_STATE_PATH diga otra cosa (antes: ruta absoluta de una máquina concreta)
+_DEFAULT_SYNC_STATE = str(Path(__file__).resolve().parent / "sync_state.json")
+
+_sync_state_cache: dict = {}  # path -> (mtime_ns, size, data)
+_sync_state_lock = threading.Lock()
+
+
+def _sync_state_path() -> Path:
+    return Path(os.getenv("SYNC_STATE_PATH", _DEFAULT_SYNC_STATE))
+
+
+def _load_sync_state(path=None):
+    """Lee y parsea `sync_state.json` con cache por (mtime, size): llamadas
+    repetidas a stats/audit/fallback no re-parsean el fichero si no cambió.
+    Devuelve el dict parseado o None si no existe / no parsea."""
+    p = Path(path) if path is not None else _sync_state_path()
+    try:
+        st = p.stat()
+    except OSError:
+        return None
+    key = str(p)
+    with _sync_state_lock:
+        entry = _sync_state_cache.get(key)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+    try:
+        raw = p.read_bytes()
+        data = _orjson.loads(raw) if _orjson is not None else json.loads(raw)
+    except Exception:
+        return None
+    with _sync_state_lock:
+        _sync_state_cache[key] = (st.st_mtime_ns, st.st_size, data)
+    return data
+
+
+def _configured_stores() -> tuple:
+    """Stores configurados (FILE_SEARCH_STORE_NAMES, parseada en el import)."""
+    return _STORES
+
+
+def _collect_all_docs(stores: list) -> tuple:
+    """Client compartido + fan-out por store. Devuelve (total, docs_list)."""
+    docs_list = _list_all_docs(_get_client(), stores)
+    return len(docs_list), docs_list
+
+
+# Página máxima por round-trip al listar documentos: con stores grandes cada
+# página es un HTTP RTT, así que pedimos la más grande que acepte la API
+STORE_LIST_PAGE_SIZE = int(os.getenv("STORE_LIST_PAGE_SIZE", "1000"))
+
+
+def _fetch_store_docs(client, store_name: str) -> list:
+    """Lista los documentos de un store y los devuelve ya formateados."""
+    out = []
+    try:
+        docs = client.file_search_stores.documents.list(
+            parent=store_name, config={"page_size": STORE_LIST_PAGE_SIZE}
+        )
+    except TypeError:
+        # Versiones del SDK sin `config` en list(): paginado por defecto
+        docs = client.file_search_stores.documents.list(parent=store_name)
+    for d in docs:
+        # getattr + `or ()` cubre el caso sin metadata sin montar un
+        # try/except por documento (se nota en audits de cientos de docs)
+        name = getattr(d, "name", "")
+        meta = {m.key: m.string_value for m in getattr(d, "custom_metadata", None) or ()}
+        out.append({"id": name, "path": meta.get("path") or name, "metadata": meta})
+    return out
+
+
+def _list_all_docs(client, stores: list) -> list:
+    """Enumera los stores en paralelo: con M stores el coste pasa de la suma
+    de sus listados al más lento de ellos."""
+    if len(stores) == 1:
+        return _fetch_store_docs(client, stores[0])
+    with ThreadPoolExecutor(max_workers=min(8, len(stores))) as pool:
+        chunks = pool.map(lambda s: _fetch_store_docs(client, s), stores)
+    return [doc for chunk in chunks for doc in chunk]
+
+
 # In-memory cache + simple lock to avoid stampedes (per-process)
 _store_stats_cache = None
 _store_stats_cache_ts = 0
+# TTL efectivo con jitter (±15%) fijado en cada escritura: evita que varios
+# procesos calentados a la vez expiren y refresquen en estampida
+_store_stats_cache_ttl = 0.0
 _store_stats_lock = threading.Lock()
+# Handoff refrescador -> esperadores: set() al terminar un refresh, así los
+# hilos que esperan despiertan al instante en vez de sondear cada 50ms
+_refresh_done = threading.Event()
+
+
+# Snapshot en disco de las stats: un proceso recién arrancado sirve la primera
+# petición desde fichero (marcada stale) en vez de pagar el listado completo
+_STATS_DISK_CACHE = Path(
+    os.getenv("STORE_STATS_CACHE_PATH", str(Path(__file__).resolve().parent / ".store_stats_cache.json"))
+)
+
+try:
+    _raw = _STATS_DISK_CACHE.read_bytes()
+    _snap = _orjson.loads(_raw) if _orjson is not None else json.loads(_raw)
+    if isinstance(_snap, dict) and "total_documents" in _snap:
+        _store_stats_cache = MappingProxyType({**_snap, "stale": True})
+        _store_stats_cache_ts = int(_STATS_DISK_CACHE.stat().st_mtime)
+    del _raw, _snap
+except Exception:
+    pass
+
+
+def _persist_store_stats(result) -> None:
+    """Best-effort: vuelca las stats a disco con escritura atómica
+    (tmp + os.replace) para el warmup del próximo arranque."""
+    try:
+        payload = dict(result)
+        payload["documents"] = list(payload.get("documents") or ())
+        raw = _orjson.dumps(payload) if _orjson is not None else json.dumps(payload).encode()
+        tmp = _STATS_DISK_CACHE.with_name(_STATS_DISK_CACHE.name + ".tmp")
+        tmp.write_bytes(raw)
+        os.replace(tmp, _STATS_DISK_CACHE)
+    except Exception:
+        pass
 
 
-def get_store_stats() -> dict:
-    """
-    Obtiene estadísticas del KB usando la API (fuente de la verdad).
-    - Cache en memoria con TTL configurable (`STORE_STATS_CACHE_TTL`).
-    - Evita stampede con un lock simple por proceso.
-    - Si la API falla, puede hacer fallback a `sync_state.json` sólo si
-      `ALLOW_LOCAL_SYNC_STATE_FALLBACK=1` está activado (por seguridad).
-    """
-    global _store_stats_cache, _store_stats_cache_ts, _store_stats_lock
+class _TryLock:
+    """Adquisición no bloqueante con semántica `with`: __enter__ devuelve si
+    se obtuvo el lock y __exit__ lo libera sólo en ese caso, sin el
+    try/release/except manual de antes (que además tragaba errores reales)."""
 
-    try:
-        ttl = int(os.getenv("STORE_STATS_CACHE_TTL", "30"))
-    except Exception:
-        ttl = 30
+    __slots__ = ("_lock", "_got")
 
-    now = int(time.time())
+    def __init__(self, lock):
+        self._lock = lock
+        self._got = False
 
-    # Fast path: cache válida
-    if _store_stats_cache is not None and (now - _store_stats_cache_ts) < ttl:
-        return _store_stats_cache
+    def __enter__(self) -> bool:
+        self._got = self._lock.acquire(blocking=False)
+        return self._got
 
-    # Intentamos refrescar tomando el lock sin bloquear demasiado
-    got_lock = _store_stats_lock.acquire(blocking=False)
-    if got_lock:
-        try:
-            # doble check
-            now = int(time.time())
-            if _store_stats_cache is not None and (now - _store_stats_cache_ts) < ttl:
-                return _store_stats_cache
-
-            api_key = os.getenv("GEMINI_API_KEY")
-            stores_raw = os.getenv("FILE_SEARCH_STORE_NAMES", "")
-            stores = [s.strip() for s in stores_raw.split(",") if s.strip()]
-
-            if not api_key or not stores:
-                raise RuntimeError("Config missing: GEMINI_API_KEY or FILE_SEARCH_STORE_NAMES")
-
-            client = genai.Client(api_key=api_key)
-
-            total = 0
-            docs_list = []
-            for store_name in stores:
-                docs = client.file_search_stores.documents.list(parent=store_name)
-                for d in docs:
-                    total += 1
-                    try:
-                        meta = {m.key: m.string_value for m in d.custom_metadata}
-                    except Exception:
-                        meta = {}
-                    display = meta.get("path") or getattr(d, "name", "")
-                    docs_list.append({"id": getattr(d, "name", ""), "path": display, "metadata": meta})
-
-            result = {"total_documents": total, "documents": docs_list}
+    def __exit__(self, *exc):
+        if self._got:
+            self._lock.release()
+        return False
 
-            _store_stats_cache = result
-            _store_stats_cache_ts = int(time.time())
-            return result
 
-        except Exception as e:
-            # Si la API falla, permitir fallback local sólo si la variable lo autoriza
-            allow_local = os.getenv("ALLOW_LOCAL_SYNC_STATE_FALLBACK", "0") == "1"
-            if allow_local:
-                try:
-                    handbook_path = Path(os.getenv("SYNC_STATE_PATH", 
-                                                   "/Users/quero/Downloads/Scripts_VSCode/Handbook_MVP_File_Search/sync_state.json"))
-                    if handbook_path.exists():
-                        with open(handbook_path) as f:
-                            state = json.load(f)
-                        result = {"total_documents": len(state), "documents": list(state.keys()), "fallback": True, "error": str(e)}
-                        _store_stats_cache = result
-                        _store_stats_cache_ts = int(time.time())
-                        return result
-                except Exception:
-                    pass
-            return {"error": str(e)}
-
-        finally:
+def _refresh_store_stats(ttl: int) -> dict:
+    """Refresca la cache de stats llamando a la API. En fallo aplica, por este
+    orden: fallback local autorizado y stale-while-error."""
+    global _store_stats_cache, _store_stats_cache_ts, _store_stats_cache_ttl
+    try:
+        if not _API_KEY or not _STORES:
+            raise RuntimeError("Config missing: GEMINI_API_KEY or FILE_SEARCH_STORE_NAMES")
+
+        total, docs_list = _collect_all_docs(_STORES)
+        # Vista inmutable: la cache se comparte entre hilos y llamadas, así
+        # que se congela al escribir en vez de copiar en cada hit
+        result = MappingProxyType({"total_documents": total, "documents": tuple(docs_list)})
+
+        _store_stats_cache = result
+        _store_stats_cache_ts = int(time.time())
+        _store_stats_cache_ttl = ttl * (1 + random.uniform(-0.15, 0.15))
+        _persist_store_stats(result)
+        return result
+
+    except Exception as e:
+        # Si la API falla, permitir fallback local sólo si la config lo autoriza
+        if _ALLOW_LOCAL_FALLBACK:
             try:
-                _store_stats_lock.release()
+                state = _load_sync_state()
+                if state is not None:
+                    result = MappingProxyType({"total_documents": len(state), "documents": tuple(state.keys()), "fallback": True, "error": str(e)})
+                    _store_stats_cache = result
+                    _store_stats_cache_ts = int(time.time())
+                    _store_stats_cache_ttl = ttl * (1 + random.uniform(-0.15, 0.15))
+                    return result
             except Exception:
                 pass
-
-    else:
-        # Otro hilo/proceso está refrescando. Esperamos un poco por la cache.
-        waited = 0.0
-        wait_interval = 0.05
-        max_wait = min(ttl, 5)
-        while waited < max_wait:
-            if _store_stats_cache is not None:
-                return _store_stats_cache
-            time.sleep(wait_interval)
-            waited += wait_interval
-
-        # Timeout: intentamos una llamada directa (sin lock) como último recurso
-        try:
-            api_key = os.getenv("GEMINI_API_KEY")
-            stores_raw = os.getenv("FILE_SEARCH_STORE_NAMES", "")
-            stores = [s.strip() for s in stores_raw.split(",") if s.strip()]
-            if not api_key or not stores:
-                return {"error": "Config missing: GEMINI_API_KEY or FILE_SEARCH_STORE_NAMES"}
-            client = genai.Client(api_key=api_key)
-            total = 0
-            docs_list = []
-            for store_name in stores:
-                docs = client.file_search_stores.documents.list(parent=store_name)
-                for d in docs:
-                    total += 1
-                    try:
-                        meta = {m.key: m.string_value for m in d.custom_metadata}
-                    except Exception:
-                        meta = {}
-                    display = meta.get("path") or getattr(d, "name", "")
-                    docs_list.append({"id": getattr(d, "name", ""), "path": display, "metadata": meta})
-
-            result = {"total_documents": total, "documents": docs_list}
+        # stale-while-error: mejor datos viejos marcados que un error a
+        # secas; el TTL corto negative-cachea el fallo unos segundos
+        if _store_stats_cache is not None:
+            result = MappingProxyType({**_store_stats_cache, "stale": True, "error": str(e)})
             _store_stats_cache = result
             _store_stats_cache_ts = int(time.time())
+            _store_stats_cache_ttl = 5.0
             return result
-        except Exception as e:
-            allow_local = os.getenv("ALLOW_LOCAL_SYNC_STATE_FALLBACK", "0") == "1"
-            if allow_local:
-                try:
-                    handbook_path = Path(os.getenv("SYNC_STATE_PATH", "/Users/quero/Downloads/Scripts_VSCode/Handbook_MVP_File_Search/sync_state.json"))
-                    if handbook_path.exists():
-                        with open(handbook_path) as f:
-                            state = json.load(f)
-                        result = {"total_documents": len(state), "documents": list(state.keys()), "fallback": True, "error": str(e)}
-                        _store_stats_cache = result
-                        _store_stats_cache_ts = int(time.time())
-                        return result
-                except Exception:
-                    pass
-            return {"error": str(e)}
+        return {"error": str(e)}
+
+
+def get_store_stats() -> dict:
+    """
+    Obtiene estadísticas del KB usando la API (fuente de la verdad).
+    - Cache en memoria con TTL configurable (`STORE_STATS_CACHE_TTL`).
+    - Evita stampede con un lock no bloqueante por proceso (`_TryLock`).
+    - Si la API falla, puede hacer fallback a `sync_state.json` sólo si
+      `ALLOW_LOCAL_SYNC_STATE_FALLBACK=1` está activado (por seguridad).
+    """
+    ttl = _STATS_TTL
+
+    # Fast path: una sola lectura de cada global del módulo
+    cache = _store_stats_cache
+    if cache is not None and (int(time.time()) - _store_stats_cache_ts) < (_store_stats_cache_ttl or ttl):
+        return cache
+
+    # Intentamos refrescar tomando el lock sin bloquear demasiado
+    with _TryLock(_store_stats_lock) as got_lock:
+        if got_lock:
+            _refresh_done.clear()
+            try:
+                # doble check bajo el lock
+                cache = _store_stats_cache
+                if cache is not None and (int(time.time()) - _store_stats_cache_ts) < (_store_stats_cache_ttl or ttl):
+                    return cache
+                return _refresh_store_stats(ttl)
+            finally:
+                _refresh_done.set()
+
+    # Otro hilo está refrescando: esperamos su señal (sin polling)
+    _refresh_done.wait(timeout=min(ttl, 5))
+    if _store_stats_cache is not None:
+        return _store_stats_cache
+
+    # Timeout: refresco directo (sin lock) como último recurso
+    return _refresh_store_stats(ttl)
 
 
 def get_store_audit() -> dict:
@@ -213,36 +440,17 @@ def get_store_audit() -> dict:
     Audita el Store REAL consultando directamente la API de Google.
     Muestra el estado actual real de los documentos.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    stores_raw = os.getenv("FILE_SEARCH_STORE_NAMES", "")
-    stores = [s.strip() for s in stores_raw.split(",") if s.strip()]
-    
-    if not api_key or not stores:
+    if not _API_KEY or not _STORES:
         return {"error": "Config missing"}
-    
+
     try:
-        client = genai.Client(api_key=api_key)
-
-        total_docs = 0
-        docs_list = []
-        for store_name in stores:
-            docs = client.file_search_stores.documents.list(parent=store_name)
-            for d in docs:
-                total_docs += 1
-                try:
-                    meta = {m.key: m.string_value for m in d.custom_metadata}
-                except Exception:
-                    meta = {}
-                display = meta.get("path") or getattr(d, "name", "")
-                docs_list.append({"id": getattr(d, "name", ""), "path": display, "metadata": meta})
-        return {"real_documents": total_docs, "documents": docs_list}
+        total, docs_list = _collect_all_docs(_STORES)
+        return {"real_documents": total, "documents": docs_list}
     except Exception as e:
         # Si la API falla, intentar fallback leyendo `sync_state.json` local
         try:
-            handbook_path = Path(os.getenv("SYNC_STATE_PATH", "/Users/quero/Downloads/Scripts_VSCode/Handbook_MVP_File_Search/sync_state.json"))
-            if handbook_path.exists():
-                with open(handbook_path) as f:
-                    state = json.load(f)
+            state = _load_sync_state()
+            if state is not None:
                 docs_list = []
                 total_docs = 0
                 # `state` mapea path -> {hash, store_doc_id}
@@ -260,106 +468,239 @@ def get_store_audit() -> dict:
         return {"error": str(e)}
 
 
+def answer_multi(parts: list) -> list | None:
+    """Resuelve varias (metadata_filter, pregunta, label) en UNA llamada
+    pidiendo salida JSON [{section, answer, sources}]. El grounding se hace
+    sobre la unión de stores (sin filtro por parte). Devuelve una lista de
+    (texto, fuentes) alineada con `parts`, o None si la llamada o el parseo
+    fallan — el caller debe hacer entonces el fan-out normal por sección.
+    """
+    stores = _configured_stores()
+    if not stores or len(parts) < 2:
+        return None
+
+    lines = []
+    for i, (_mf, q, label) in enumerate(parts, 1):
+        lines.append(f"{i}. [{label or 'general'}] {q}")
+    prompt = (
+        "Responde cada pregunta numerada por separado usando la base de "
+        "conocimiento. Devuelve SOLO un array JSON con un objeto por pregunta, "
+        'en el mismo orden: [{"section": str, "answer": str, "sources": [str]}]\n\n'
+        + "\n".join(lines)
+    )
+
+    try:
+        client = _get_client()
+        tool = types.Tool(file_search=types.FileSearch(file_search_store_names=list(stores)))
+        resp = client.models.generate_content(
+            model=_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                system_instruction=SYSTEM_INSTRUCTION,
+                tools=[tool],
+                temperature=0.2,
+                response_mime_type="application/json",
+            ),
+        )
+        data = json.loads(resp.text or "")
+        if not isinstance(data, list) or len(data) != len(parts):
+            return None
+        return [
+            (
+                (item.get("answer") or "").strip(),
+                [s for s in (item.get("sources") or []) if isinstance(s, str)],
+            )
+            for item in data
+        ]
+    except Exception:
+        return None
+
+
+def submit_batch(prompts: List[str], display_name: str = "kb-batch") -> str:
+    """Envía prompts no interactivos por la Batch API de Gemini (coste ~50%,
+    SLA de hasta 24h). Pensado para digests programados o re-procesos del KB,
+    nunca para DMs en vivo. Devuelve el nombre del job para sondearlo después.
+    """
+    client = _get_client()
+    inlined = [
+        {"contents": [{"parts": [{"text": p}], "role": "user"}]}
+        for p in prompts
+    ]
+    job = client.batches.create(model=_MODEL, src=inlined, config={"display_name": display_name})
+    return job.name
+
+
+def get_batch_results(job_name: str) -> Tuple[bool, List[str]]:
+    """Consulta un job de `submit_batch`. Devuelve (terminado, textos).
+    Mientras el job siga en cola/ejecución devuelve (False, []).
+    """
+    client = _get_client()
+    job = client.batches.get(name=job_name)
+    state = getattr(getattr(job, "state", None), "name", "")
+    if state not in ("JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED"):
+        return False, []
+
+    texts = []
+    for r in getattr(getattr(job, "dest", None), "inlined_responses", None) or []:
+        resp = getattr(r, "response", None)
+        texts.append((getattr(resp, "text", "") or "").strip() if resp else "")
+    return True, texts
+
+
 def _extract_sources(resp) -> List[str]:
     # En File Search, las citas se exponen via grounding_metadata. :contentReference[oaicite:2]{index=2}
-    out = []
     try:
-        gm = resp.candidates[0].grounding_metadata
-        chunks = getattr(gm, "grounding_chunks", None) or []
-        for ch in chunks:
-            rc = getattr(ch, "retrieved_context", None)
-            if not rc:
-                continue
-            title = getattr(rc, "title", None) or ""
-            uri = getattr(rc, "uri", None) or ""
-            label = (title or uri).strip()
-            if label:
-                out.append(label)
-    except Exception:
+        chunks = resp.candidates[0].grounding_metadata.grounding_chunks or ()
+    except (AttributeError, IndexError, TypeError):
         return []
 
-    # unique manteniendo orden
+    # una sola pasada: extracción + dedupe preservando orden
     seen = set()
-    uniq = []
-    for s in out:
-        if s not in seen:
-            uniq.append(s)
-            seen.add(s)
-    return uniq
+    out = []
+    for ch in chunks:
+        rc = getattr(ch, "retrieved_context", None)
+        if rc is None:
+            continue
+        label = (getattr(rc, "title", None) or getattr(rc, "uri", None) or "").strip()
+        if label and label not in seen:
+            seen.add(label)
+            out.append(label)
+    return out
 
 
-def _local_answer_fallback(question: str, max_results: int = 3) -> Tuple[str, List[str]]:
-    """Fallback simple: busca en los archivos locales del KB usando `sync_state.json`.
-    Devuelve (texto_agregado, [paths])
-    """
-    try:
-        import re
-        sync_path = Path(os.getenv("SYNC_STATE_PATH", "/Users/quero/Downloads/Scripts_VSCode/Handbook_MVP_File_Search/sync_state.json"))
-        kb_root = Path(os.getenv("KB_ROOT", "/Users/quero/Downloads/Scripts_VSCode/Handbook_MVP_File_Search/kb"))
+_WORD_RE = re.compile(r"\w+")
 
-        if not sync_path.exists():
-            return ("", [])
+# Índice invertido del KB local (token -> {path: tf}) para el fallback: se
+# construye una vez por versión de sync_state.json en lugar de leer y escanear
+# todos los ficheros en cada pregunta
+_kb_index = None
+_kb_paths: dict = {}  # path del state -> Path real en disco
+_kb_index_key = None  # (mtime_ns, size) del sync_state que originó el índice
+_kb_index_lock = threading.Lock()
 
-        with open(sync_path) as f:
-            state = json.load(f)
 
-        q = (question or "").lower()
-        tokens = re.findall(r"\w+", q)
+# Tope de lectura por fichero: de sobra para indexar y para snippets de 4000
+# chars, y acota la RSS del fallback aunque el handbook tenga ficheros enormes
+_MAX_READ_BYTES = 65536
+
+
+# Ventana de snippet en bytes: sólo se decodifica este prefijo por documento
+# elegido, no los 64KiB completos de la lectura
+_SNIPPET_BYTES = 4000
+
 
-        results = []  # (score, path, content)
+def _read_capped_bytes(fp: Path):
+    """Lee como máximo _MAX_READ_BYTES crudos; None si está vacío o falla."""
+    try:
+        if fp.stat().st_size == 0:
+            return None
+        with fp.open("rb") as fh:
+            return fh.read(_MAX_READ_BYTES)
+    except OSError:
+        return None
+
+
+def _read_capped(fp: Path):
+    """Como _read_capped_bytes pero decodificado (para indexar)."""
+    raw = _read_capped_bytes(fp)
+    return None if raw is None else raw.decode("utf-8", errors="ignore")
+
+
+def _resolve_kb_file(kb_root: Path, p: str):
+    """Mapea una key del sync_state al fichero real bajo KB_ROOT (o None)."""
+    # Normalize path: state keys often include a leading 'kb/'
+    rel = p[len("kb/"):] if p.startswith("kb/") else p
+    fp = kb_root.joinpath(rel)
+    if not fp.exists():
+        fp = kb_root.joinpath(rel.lstrip("/"))
+    return fp if fp.exists() else None
+
+
+def _build_kb_index():
+    """(Re)construye el índice invertido si cambió el sync_state. Devuelve el
+    índice o None si no hay estado local utilizable."""
+    global _kb_index, _kb_paths, _kb_index_key
+    try:
+        st = _sync_state_path().stat()
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+    with _kb_index_lock:
+        if _kb_index is not None and _kb_index_key == key:
+            return _kb_index
+
+        state = _load_sync_state()
+        if state is None:
+            return None
+
+        kb_root = Path(os.getenv("KB_ROOT", str(_sync_state_path().parent / "kb")))
+        index = defaultdict(dict)
+        paths = {}
         for p in state.keys():
-            try:
-                # Normalize path: state keys often include a leading 'kb/'
-                rel = p
-                if rel.startswith("kb/"):
-                    rel = rel[len("kb/"):]
-                file_path = kb_root.joinpath(rel)
-                if not file_path.exists():
-                    # fallback try without leading slash
-                    file_path = kb_root.joinpath(rel.lstrip("/"))
-                if not file_path.exists():
-                    continue
-                txt = file_path.read_text(encoding="utf-8")
-                tl = txt.lower()
-                score = 0
-                for t in tokens:
-                    if not t:
-                        continue
-                    score += tl.count(t)
-                # also bump if whole question phrase found
-                if q and q in tl:
-                    score += 5
-                if score > 0:
-                    results.append((score, str(p), txt))
-            except Exception:
+            fp = _resolve_kb_file(kb_root, p)
+            if fp is None:
+                continue
+            txt = _read_capped(fp)
+            if txt is None:
                 continue
+            paths[str(p)] = fp
+            for tok, tf in Counter(_WORD_RE.findall(txt.lower())).items():
+                index[tok][str(p)] = tf
 
-        # If no results by token-match, pick up to max_results by file size heuristic
-        if not results:
-            fallback = []
-            for p in state.keys():
-                try:
-                    file_path = kb_root.joinpath(p)
-                    if not file_path.exists():
-                        file_path = kb_root.joinpath(p.lstrip("/"))
-                    if not file_path.exists():
-                        continue
-                    txt = file_path.read_text(encoding="utf-8")
-                    fallback.append((len(txt), str(p), txt))
-                except Exception:
-                    continue
-            fallback.sort(reverse=True)
-            results = [(s, p, t) for s, p, t in fallback[:max_results]]
-
-        # Sort by score desc
-        results.sort(key=lambda x: x[0], reverse=True)
+        _kb_index = dict(index)
+        _kb_paths = paths
+        _kb_index_key = key
+        return _kb_index
+
+
+def _local_answer_fallback(question: str, max_results: int = 3) -> Tuple[str, List[str]]:
+    """Fallback simple: busca en los archivos locales del KB usando el índice
+    invertido derivado de `sync_state.json`. Devuelve (texto_agregado, [paths])
+    """
+    try:
+        index = _build_kb_index()
+        if not index:
+            return ("", [])
+
+        q = (question or "").lower()
+        tokens = _WORD_RE.findall(q)
+
+        # puntuar: suma de term-frequencies por documento (O(tokens × postings));
+        # el set evita repetir el merge de postings con tokens duplicados
+        scores = Counter()
+        for t in set(tokens):
+            postings = index.get(t)
+            if postings:
+                scores.update(postings)
+
+        top = [p for p, _ in scores.most_common(max_results)]
+
+        # Sin matches: heurística por tamaño de fichero (stat, sin leer contenido)
+        if not top:
+            by_size = sorted(
+                _kb_paths.items(),
+                key=lambda item: item[1].stat().st_size if item[1].exists() else 0,
+                reverse=True,
+            )
+            top = [p for p, _ in by_size[:max_results]]
 
         snippets = []
         sources = []
-        for _, p, txt in results[:max_results]:
-            snippet = txt.strip()
-            if len(snippet) > 4000:
-                snippet = snippet[:4000] + "..."
+        for p in top:
+            fp = _kb_paths.get(p)
+            if fp is None:
+                continue
+            raw = _read_capped_bytes(fp)
+            if not raw:
+                continue
+            # Decodificar sólo la ventana del snippet, no la lectura entera;
+            # errors="ignore" descarta un multibyte cortado por el slice
+            snippet = raw[:_SNIPPET_BYTES].decode("utf-8", "ignore").strip()
+            if not snippet:
+                continue
+            if len(raw) > _SNIPPET_BYTES:
+                snippet += "..."
             snippets.append(snippet)
             sources.append(p)
 
@@ -373,46 +714,101 @@ def _local_answer_fallback(question: str, max_results: int = 3) -> Tuple[str, Li
         return ("", [])
 
 
-def answer(question: str, metadata_filter: str | None = None) -> Tuple[str, List[str]]:
-    api_key = os.getenv("GEMINI_API_KEY")
-    model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-    stores_raw = os.getenv("FILE_SEARCH_STORE_NAMES", "")
-    stores = [s.strip() for s in stores_raw.split(",") if s.strip()]
+# Singleflight: colapsa llamadas concurrentes con la misma clave de cache —
+# la primera hace el round-trip a Gemini y las demás esperan su Future en vez
+# de duplicar el gasto (típico en preguntas "virales" en Slack)
+_INFLIGHT: dict = {}  # cache_key -> Future
+_INFLIGHT_LOCK = threading.Lock()
 
-    if not api_key:
+
+def answer(question: str, metadata_filter: str | None = None) -> Tuple[str, List[str]]:
+    if not _API_KEY:
         raise RuntimeError("Falta GEMINI_API_KEY en .env")
-    if not stores:
+    if not _STORES:
         raise RuntimeError("Falta FILE_SEARCH_STORE_NAMES en .env")
 
-    client = genai.Client(api_key=api_key)
+    cache_key = _answer_cache_key(question, metadata_filter, _MODEL)
+    cached = _answer_cache_get(cache_key)
+    if cached is not None:
+        text, sources = cached
+        return text, list(sources)
+
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(cache_key)
+        leader = fut is None
+        if leader:
+            fut = Future()
+            _INFLIGHT[cache_key] = fut
+
+    if not leader:
+        # Piggyback: la misma pregunta ya está en vuelo; esperamos su resultado
+        text, sources = fut.result(timeout=90)
+        return text, list(sources)
+
+    try:
+        text, sources = _answer_upstream(question, metadata_filter, cache_key)
+        fut.set_result((text, tuple(sources)))
+        return text, sources
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(cache_key, None)
+
+
+def _answer_upstream(question, metadata_filter, cache_key) -> Tuple[str, List[str]]:
+    """Round-trip real a Gemini (más fallback local). Sólo lo ejecuta el líder
+    del singleflight de `answer`."""
+    client = _get_client()
 
     tool = types.Tool(
         file_search=types.FileSearch(
-            file_search_store_names=stores,
+            file_search_store_names=list(_STORES),
             # Ejemplo simple de filtro por metadata: :contentReference[oaicite:3]{index=3}
             # metadata_filter='department="operations" AND team="support"'
             metadata_filter=metadata_filter,
         )
     )
 
+    inline_config = types.GenerateContentConfig(
+        system_instruction=SYSTEM_INSTRUCTION,
+        tools=[tool],
+        temperature=0.2,
+    )
+
     try:
-        resp = client.models.generate_content(
-            model=model,
-            contents=question,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_INSTRUCTION,
-                tools=[tool],
-                temperature=0.2,
-            ),
-        )
+        cache_name = None if metadata_filter else _get_context_cache(client, _MODEL, tool)
+        if cache_name:
+            try:
+                resp = client.models.generate_content(
+                    model=_MODEL,
+                    contents=question,
+                    config=types.GenerateContentConfig(
+                        cached_content=cache_name,
+                        temperature=0.2,
+                    ),
+                )
+            except Exception:
+                # cache expirado o borrado del lado del servidor: se recreará
+                # en la próxima llamada; ésta sigue con la config inline
+                _invalidate_context_cache()
+                resp = client.models.generate_content(
+                    model=_MODEL, contents=question, config=inline_config
+                )
+        else:
+            resp = client.models.generate_content(
+                model=_MODEL, contents=question, config=inline_config
+            )
 
         text = (resp.text or "").strip()
         sources = _extract_sources(resp)
+        if text:
+            _answer_cache_put(cache_key, (text, tuple(sources)))
         return text, sources
     except Exception as e:
         # Si la API de generación/filtrado falla, intentar fallback local
-        allow_local = os.getenv("ALLOW_LOCAL_SYNC_STATE_FALLBACK", "0") == "1"
-        if allow_local:
+        if _ALLOW_LOCAL_FALLBACK:
             local_text, local_sources = _local_answer_fallback(question)
             if local_text:
                 # For MVP UX: do not expose local fallback sources as "Fuentes".
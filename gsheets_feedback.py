@@ -1,14 +1,14 @@
 """
 Small helper to append feedback rows to a Google Sheet using a local OAuth token
 
-Expect a `secrets/token.pickle` generated by `scripts/get_gsheet_token.py` and
+Expect a `secrets/token.json` generated by `scripts/get_gsheet_token.py` and
 `secrets/credentials.json` (the OAuth client) next to it.
 
 This module exposes `append_feedback_row(dict)` which accepts a row dict with
 keys: timestamp, username, email, prompt, response, rating, comment, fallback
 """
 from pathlib import Path
-import pickle
+import json
 import time
 import logging
 from typing import Dict, Iterable
@@ -16,12 +16,16 @@ from datetime import datetime
 
 import gspread
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 
 LOG = logging.getLogger(__name__)
 
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
 ROOT = Path(__file__).resolve().parent
 SECRETS = ROOT / "secrets"
-TOKEN_PATH = SECRETS / "token.pickle"
+TOKEN_PATH = SECRETS / "token.json"
+LEGACY_TOKEN_PATH = SECRETS / "token.pickle"
 CREDENTIALS_PATH = SECRETS / "credentials.json"
 
 SHEET_ID = None  # set via env or override before use
@@ -39,17 +43,27 @@ HEADERS = [
 ]
 
 
+def _load_credentials():
+    """Load the stored token. JSON is the canonical format; a leftover
+    token.pickle from older setups is still accepted as a fallback."""
+    if TOKEN_PATH.exists():
+        return Credentials.from_authorized_user_info(
+            json.loads(TOKEN_PATH.read_text()), SCOPES
+        )
+    if LEGACY_TOKEN_PATH.exists():
+        import pickle
+        with open(LEGACY_TOKEN_PATH, "rb") as f:
+            return pickle.load(f)
+    raise RuntimeError(f"Missing token file at {TOKEN_PATH}. Run scripts/get_gsheet_token.py first")
+
+
 def _get_gspread_client():
-    if not TOKEN_PATH.exists():
-        raise RuntimeError(f"Missing token file at {TOKEN_PATH}. Run scripts/get_gsheet_token.py first")
-    with open(TOKEN_PATH, "rb") as f:
-        creds = pickle.load(f)
+    creds = _load_credentials()
 
     if getattr(creds, "expired", False) and getattr(creds, "refresh_token", None):
         try:
             creds.refresh(Request())
-            with open(TOKEN_PATH, "wb") as f:
-                pickle.dump(creds, f)
+            TOKEN_PATH.write_text(creds.to_json())
         except Exception:
             LOG.exception("Failed to refresh credentials")
 
@@ -67,19 +81,8 @@ def _ensure_headers(ws):
         LOG.warning("Could not check/create headers: %s", e)
 
 
-def append_feedback_row(row: Dict[str, object], sheet_id: str | None = None):
-    """Append a single row to the sheet with proper formatting."""
-    sheet_key = sheet_id or SHEET_ID
-    if not sheet_key:
-        raise RuntimeError("SHEET_ID is not configured. Provide sheet_id argument or set gsheets_feedback.SHEET_ID")
-
-    client = _get_gspread_client()
-    sh = client.open_by_key(sheet_key)
-    ws = sh.sheet1
-
-    # Ensure headers exist
-    _ensure_headers(ws)
-
+def _row_values(row: Dict[str, object]) -> list:
+    """Convert a row dict into the ordered cell values for the sheet."""
     # Format timestamp as readable datetime
     ts = row.get("timestamp", int(time.time()))
     if isinstance(ts, (int, float)):
@@ -87,7 +90,7 @@ def append_feedback_row(row: Dict[str, object], sheet_id: str | None = None):
     else:
         ts_str = str(ts)
 
-    values = [
+    return [
         ts_str,
         row.get("username", ""),
         row.get("email", ""),
@@ -97,10 +100,29 @@ def append_feedback_row(row: Dict[str, object], sheet_id: str | None = None):
         row.get("comment", ""),
         str(row.get("fallback", False)),
     ]
-    ws.append_row(values, value_input_option="USER_ENTERED")
-    LOG.info("Feedback row appended to sheet")
+
+
+def append_feedback_row(row: Dict[str, object], sheet_id: str | None = None):
+    """Append a single row to the sheet with proper formatting."""
+    append_feedback_rows([row], sheet_id=sheet_id)
 
 
 def append_feedback_rows(rows: Iterable[Dict[str, object]], sheet_id: str | None = None):
-    for r in rows:
-        append_feedback_row(r, sheet_id=sheet_id)
+    """Append many rows in ONE Sheets RPC (append_rows) instead of one per row."""
+    values = [_row_values(r) for r in rows]
+    if not values:
+        return
+
+    sheet_key = sheet_id or SHEET_ID
+    if not sheet_key:
+        raise RuntimeError("SHEET_ID is not configured. Provide sheet_id argument or set gsheets_feedback.SHEET_ID")
+
+    client = _get_gspread_client()
+    sh = client.open_by_key(sheet_key)
+    ws = sh.sheet1
+
+    # Ensure headers exist
+    _ensure_headers(ws)
+
+    ws.append_rows(values, value_input_option="USER_ENTERED")
+    LOG.info("%d feedback row(s) appended to sheet", len(values))
@@ -3,7 +3,7 @@
 One-time script to perform OAuth desktop flow and save a token file
 
 Place your downloaded OAuth client JSON in `secrets/credentials.json` and run this
-script once. It will open the browser to authorize and create `secrets/token.pickle`.
+script once. It will open the browser to authorize and create `secrets/token.json`.
 
 Usage:
   python3 scripts/get_gsheet_token.py
@@ -11,11 +11,12 @@ Usage:
 Do NOT commit the files inside `secrets/`.
 """
 from pathlib import Path
-import pickle
+import json
 import sys
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
@@ -23,7 +24,7 @@ SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 ROOT = Path(__file__).resolve().parent.parent
 SECRETS = ROOT / "secrets"
 CREDENTIALS_PATH = SECRETS / "credentials.json"
-TOKEN_PATH = SECRETS / "token.pickle"
+TOKEN_PATH = SECRETS / "token.json"
 
 
 def main() -> None:
@@ -35,8 +36,12 @@ def main() -> None:
 
     creds = None
     if TOKEN_PATH.exists():
-        with open(TOKEN_PATH, "rb") as f:
-            creds = pickle.load(f)
+        try:
+            creds = Credentials.from_authorized_user_info(
+                json.loads(TOKEN_PATH.read_text()), SCOPES
+            )
+        except Exception:
+            print(f"Could not parse {TOKEN_PATH}; re-running the OAuth flow")
 
     if not creds or not getattr(creds, "valid", False):
         if creds and getattr(creds, "expired", False) and getattr(creds, "refresh_token", None):
@@ -45,8 +50,7 @@ def main() -> None:
             flow = InstalledAppFlow.from_client_secrets_file(str(CREDENTIALS_PATH), SCOPES)
             creds = flow.run_local_server(port=0)
 
-        with open(TOKEN_PATH, "wb") as f:
-            pickle.dump(creds, f)
+        TOKEN_PATH.write_text(creds.to_json())
         print(f"Saved token to {TOKEN_PATH}")
 
     print("Access token valid:", getattr(creds, "valid", False))
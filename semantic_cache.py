@@ -0,0 +1,143 @@
+"""
+Cache semántica opcional para respuestas del bot.
+
+Si `sentence-transformers` y `faiss` están instalados, las preguntas nuevas se
+comparan (coseno) contra preguntas ya respondidas y, si la similitud supera el
+umbral, se devuelve la respuesta cacheada sin tocar el modelo. Si faltan las
+dependencias, `lookup`/`store` son no-ops baratos y el bot funciona igual.
+
+Variables de entorno:
+  SEMANTIC_CACHE_THRESHOLD  similitud mínima para un hit (default 0.92)
+  SEMANTIC_CACHE_MODEL      modelo de embeddings (default all-MiniLM-L6-v2)
+  SEMANTIC_CACHE_PATH       directorio donde persistir el índice al apagar
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    import numpy as np
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    _AVAILABLE = True
+except Exception:
+    _AVAILABLE = False
+
+LOG = logging.getLogger(__name__)
+
+SIM_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+MODEL_NAME = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+CACHE_DIR = Path(os.getenv("SEMANTIC_CACHE_PATH", "./semantic_cache"))
+
+_lock = threading.Lock()
+_model = None
+_index = None
+# Lista paralela al índice: una entrada por vector añadido
+_entries: list = []  # {"metadata_filter": ..., "text": ..., "ts": ...}
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def _ensure_ready() -> bool:
+    """Carga el modelo e índice la primera vez. Devuelve False si no hay deps."""
+    global _model, _index
+    if not _AVAILABLE:
+        return False
+    if _model is not None and _index is not None:
+        return True
+    try:
+        _model = SentenceTransformer(MODEL_NAME)
+        dim = _model.get_sentence_embedding_dimension()
+        _index = faiss.IndexFlatIP(dim)
+        _load()
+        LOG.info("Semantic cache ready (model=%s, entries=%d)", MODEL_NAME, len(_entries))
+        return True
+    except Exception:
+        LOG.exception("Semantic cache init failed; disabled")
+        _model = None
+        _index = None
+        return False
+
+
+def _embed(text: str):
+    vec = _model.encode([_normalize(text)], normalize_embeddings=True)
+    return np.asarray(vec, dtype="float32")
+
+
+def lookup(text: str, metadata_filter: Optional[str] = None) -> Optional[str]:
+    """Devuelve la respuesta cacheada si hay una pregunta suficientemente parecida."""
+    with _lock:
+        if not _ensure_ready() or _index.ntotal == 0:
+            return None
+        try:
+            vec = _embed(text)
+            k = min(5, _index.ntotal)
+            sims, ids = _index.search(vec, k)
+            for sim, idx in zip(sims[0], ids[0]):
+                if idx < 0 or sim < SIM_THRESHOLD:
+                    continue
+                entry = _entries[idx]
+                if entry.get("metadata_filter") == metadata_filter:
+                    LOG.info("Semantic cache hit (sim=%.3f)", float(sim))
+                    return entry.get("text")
+            return None
+        except Exception:
+            LOG.exception("Semantic cache lookup failed")
+            return None
+
+
+def store(text: str, metadata_filter: Optional[str], final_text: str):
+    """Guarda (pregunta, filtro) -> respuesta para futuros lookups."""
+    if not final_text:
+        return
+    with _lock:
+        if not _ensure_ready():
+            return
+        try:
+            _index.add(_embed(text))
+            _entries.append({
+                "metadata_filter": metadata_filter,
+                "text": final_text,
+                "ts": int(time.time()),
+            })
+        except Exception:
+            LOG.exception("Semantic cache store failed")
+
+
+def _load():
+    try:
+        idx_path = CACHE_DIR / "index.faiss"
+        entries_path = CACHE_DIR / "entries.json"
+        if idx_path.exists() and entries_path.exists():
+            loaded = faiss.read_index(str(idx_path))
+            entries = json.loads(entries_path.read_text(encoding="utf-8"))
+            if loaded.ntotal == len(entries) and loaded.d == _index.d:
+                globals()["_index"] = loaded
+                _entries[:] = entries
+    except Exception:
+        LOG.exception("Semantic cache load failed; starting empty")
+
+
+def save():
+    """Persiste índice y entradas a disco (llamado al apagar)."""
+    with _lock:
+        if _index is None or _index.ntotal == 0:
+            return
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            faiss.write_index(_index, str(CACHE_DIR / "index.faiss"))
+            (CACHE_DIR / "entries.json").write_text(
+                json.dumps(_entries, ensure_ascii=False), encoding="utf-8"
+            )
+        except Exception:
+            LOG.exception("Semantic cache save failed")
+
+
+atexit.register(save)
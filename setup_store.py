@@ -53,10 +53,13 @@ op = client.file_search_stores.upload_to_file_search_store(
     },
 )
 
-# Esperar a que termine
+# Esperar a que termine: backoff exponencial (0.5s → 8s). Los imports pequeños
+# terminan en <1s y no pagan el sleep fijo de 3s; los grandes sondean menos.
+delay = 0.5
 while not op.done:
-    print("...indexando (espera 3s)")
-    time.sleep(3)
+    print(f"...indexando (espera {delay:g}s)")
+    time.sleep(delay)
+    delay = min(delay * 2, 8.0)
     op = client.operations.get(op)
 
 print("✅ Import terminado. Ya puedes usar el store:", store.name)
\ No newline at end of file